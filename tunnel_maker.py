@@ -1,18 +1,26 @@
 #!/usr/bin/env python3
 
+import asyncio
+import concurrent.futures
 import configparser
+import math
 import os
+import pickle
+import urllib.parse
 import sys
-import requests
-from fabric import Connection
-from paramiko import RSAKey
-import tempfile
+import io
 from pathlib import Path
 import logging
 import argparse
 import textwrap
 
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+
 logger = logging.getLogger('tunnel_maker')
 
 
@@ -58,6 +66,13 @@ def parse_command_line_arguments():
         default="47827:localhost:47827"
     )
 
+    parser.add_argument(
+        "--deep_check",
+        help="Verify the SSH connections by running a test command on the remote hosts, "
+             "instead of only checking that the SSH transport is active.",
+        action='store_true'
+    )
+
     parser.add_argument(
         "--rescale_ssh_private_key",
         help="The SSH private key file used on Rescale. The corresponding public key must be configured in "
@@ -129,9 +144,59 @@ def get_api_key_from_envvar(cl_args):
     return None, cl_args.api_base_url
 
 
-def get_api_key_from_config_file(cl_args):
+def get_apiconfig_cache_path():
     """
-    Get the api_key and api_base_url from the API configuration file.
+    Return the path of the cache file for the parsed API configuration file.
+    """
+    return Path.home().joinpath('.cache', 'tunnel_maker', 'apiconfig.pkl')
+
+
+def read_apiconfig_cache(config_file):
+    """
+    Read the cached API profiles if the cache matches the current mtime and size
+    of the API configuration file.
+    Return None on a cache miss.
+    :param config_file: Path object, the API configuration file.
+    """
+    file_stat = config_file.stat()
+    try:
+        with open(get_apiconfig_cache_path(), 'rb') as f:
+            cache = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+    if cache.get('mtime') == file_stat.st_mtime and cache.get('size') == file_stat.st_size:
+        return cache.get('profiles')
+
+    return None
+
+
+def write_apiconfig_cache(config_file, profiles):
+    """
+    Write the parsed API profiles to the cache file,
+    keyed by the mtime and size of the API configuration file.
+    :param config_file: Path object, the API configuration file.
+    :param profiles: dict mapping profile names to profile dicts.
+    """
+    file_stat = config_file.stat()
+    cache = {'mtime': file_stat.st_mtime, 'size': file_stat.st_size, 'profiles': profiles}
+    cache_path = get_apiconfig_cache_path()
+    try:
+        cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        temp_path = cache_path.with_suffix('.tmp')
+        with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError as err:
+        logger.warning(f'Could not write cache file {cache_path}: {err}')
+
+
+def get_profile_from_config_file(cl_args):
+    """
+    Get the profile from the API configuration file as a plain dict,
+    so additional profile keys can be read without per-access configparser overhead.
+    The parsed configuration is cached, so repeat runs skip parsing
+    as long as the configuration file is unchanged.
     :param cl_args: command line arguments
     """
     logger.info(f'Reading API configuration file {cl_args.api_config_file}, '
@@ -140,9 +205,22 @@ def get_api_key_from_config_file(cl_args):
     if not cl_args.api_config_file.is_file():
         raise FileNotFoundError(f'File {cl_args.api_config_file} not found!')
 
-    config = configparser.ConfigParser()
-    config.read(cl_args.api_config_file)
-    api_profile = config[cl_args.api_profile]
+    profiles = read_apiconfig_cache(cl_args.api_config_file)
+    if profiles is None:
+        config = configparser.ConfigParser()
+        config.read(cl_args.api_config_file)
+        profiles = {name: dict(section) for name, section in config.items()}
+        write_apiconfig_cache(cl_args.api_config_file, profiles)
+
+    return profiles[cl_args.api_profile]
+
+
+def get_api_key_from_config_file(cl_args):
+    """
+    Get the api_key and api_base_url from the API configuration file.
+    :param cl_args: command line arguments
+    """
+    api_profile = get_profile_from_config_file(cl_args)
     try:
         api_key = api_profile['apikey']
         api_base_url = api_profile['apibaseurl']
@@ -161,6 +239,8 @@ def log_and_raise_for_status(response):
     If request was unsuccessful, log resonse.text and raise HTTPError.
     :param response: Response Object
     """
+    import requests
+
     try:
         response.raise_for_status()
     except requests.exceptions.HTTPError as err:
@@ -178,9 +258,81 @@ class Api:
         :param api_key: Rescale API key
         :param base_url: Rescale API base URL
         """
+        import requests
+        from urllib3.util.retry import Retry
+
         self.api_key = api_key
         self.authorization = f'Token {self.api_key}'
         self.base_url = base_url
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = self.authorization
+        self.session.mount('https://', requests.adapters.HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=8,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504])
+        ))
+
+    @staticmethod
+    def build_remaining_page_urls(payload, next_url):
+        """
+        Build the URLs of all result pages after the first one,
+        if the total number of pages can be inferred from the first page.
+        Return None if the pagination scheme does not use page numbers.
+        :param payload: parsed payload of the first result page.
+        :param next_url: URL of the second result page.
+        """
+        count = payload.get("count")
+        page_size = len(payload["results"])
+        if not count or page_size == 0:
+            return None
+
+        split_url = urllib.parse.urlsplit(next_url)
+        query = urllib.parse.parse_qs(split_url.query)
+        if 'page' not in query:
+            return None
+
+        total_pages = math.ceil(count / page_size)
+        return [
+            urllib.parse.urlunsplit(
+                split_url._replace(query=urllib.parse.urlencode({**query, 'page': page}, doseq=True))
+            )
+            for page in range(2, total_pages + 1)
+        ]
+
+    def iter_all_result_pages(self, url, params=None):
+        """
+        Iterate over all results of a paginated GET request.
+        If the total number of pages can be inferred from the first page,
+        the remaining pages are fetched concurrently; otherwise the 'next' links
+        are followed one by one.
+        The session is reused for all requests, so the HTTPS connection is kept alive.
+        :param url: URL for the GET request.
+        :param params: parameters for the GET request.
+        """
+        params = {'page_size': 1000, **(params or {})}
+        response = self.session.get(url, params=params)
+        log_and_raise_for_status(response)
+        payload = json_loads(response.content)
+        yield from payload["results"]
+
+        next_url = payload["next"]
+        if next_url is None:
+            return
+
+        remaining_urls = self.build_remaining_page_urls(payload, next_url)
+        if remaining_urls is not None:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+                for response in executor.map(self.session.get, remaining_urls):
+                    log_and_raise_for_status(response)
+                    yield from json_loads(response.content)["results"]
+            return
+
+        while next_url is not None:
+            response = self.session.get(next_url)
+            log_and_raise_for_status(response)
+            payload = json_loads(response.content)
+            yield from payload["results"]
+            next_url = payload["next"]
 
     def get_all_result_pages(self, url, params=None):
         """
@@ -188,51 +340,119 @@ class Api:
         :param url: URL for the GET request.
         :param params: parameters for the GET request.
         """
-        results = []
-        response = requests.get(
-            url,
-            headers={'Authorization': self.authorization},
-            params=params
-        )
-        log_and_raise_for_status(response)
-        results.extend(response.json()["results"])
+        return list(self.iter_all_result_pages(url, params=params))
 
-        while response.json()["next"] is not None:
-            response = requests.get(response.json()["next"], headers={'Authorization': self.authorization})
-            log_and_raise_for_status(response)
-            results.extend(response.json()["results"])
-        return results
+    def iter_instances(self, job_id):
+        """
+        Iterate over the instances of a job, fetching result pages lazily.
+        :param job_id: ID of the job
+        """
+        return self.iter_all_result_pages(
+            f"{self.base_url}/api/v2/jobs/{job_id}/instances/"
+        )
 
     def get_instances(self, job_id):
         """
         Get the list of instances for a job.
         :param job_id: ID of the job
         """
-        instances = self.get_all_result_pages(
-            f"{self.base_url}/api/v2/jobs/{job_id}/instances/"
-        )
-        return instances
+        return list(self.iter_instances(job_id))
 
     def get_head_node(self, job_id):
         """
         Retrun information about the head node of a job.
+        Stop fetching result pages as soon as the head node is found.
         Exit if no instances can be found.
         :param job_id: ID of the job
         """
-        instances = self.get_instances(job_id)
+        first_instance = None
+        for instance in self.iter_instances(job_id):
+            if first_instance is None:
+                first_instance = instance
+            if instance.get('role') == 'MPI_MASTER':
+                return instance
 
-        if len(instances) == 0:
+        if first_instance is None:
             logger.error(f'No instances found for JobID {job_id!r}. Is the cluster running?')
             sys.exit(1)
 
-        if len(instances) == 1:
-            return instances[0]
+        return first_instance
 
-        for instance in instances:
+    def get_head_nodes(self, job_ids):
+        """
+        Get the head nodes of several jobs concurrently.
+        The lookups are batched onto a single HTTP/2 connection with request multiplexing.
+        :param job_ids: iterable of job IDs.
+        """
+        async_api = AsyncApi(api_key=self.api_key, base_url=self.base_url)
+        return asyncio.run(async_api.aget_head_nodes(job_ids))
+
+
+class AsyncApi:
+    """
+    Class for asynchronous access to the Rescale API.
+    Requests are multiplexed over a single HTTP/2 connection.
+    """
+
+    def __init__(self, api_key, base_url='https://platform.rescale.com'):
+        """
+        :param api_key: Rescale API key
+        :param base_url: Rescale API base URL
+        """
+        import httpx
+
+        self.api_key = api_key
+        self.authorization = f'Token {self.api_key}'
+        self.base_url = base_url
+        self.client = httpx.AsyncClient(http2=True, headers={'Authorization': self.authorization})
+
+    async def aiter_instances(self, job_id):
+        """
+        Iterate over the instances of a job, fetching result pages lazily.
+        :param job_id: ID of the job
+        """
+        url = f"{self.base_url}/api/v2/jobs/{job_id}/instances/"
+        params = {'page_size': 1000}
+        while url is not None:
+            response = await self.client.get(url, params=params)
+            if response.is_error:
+                logger.error(response.text)
+            response.raise_for_status()
+            payload = json_loads(response.content)
+            for instance in payload["results"]:
+                yield instance
+            url = payload["next"]
+            params = None
+
+    async def aget_head_node(self, job_id):
+        """
+        Retrun information about the head node of a job.
+        Stop fetching result pages as soon as the head node is found.
+        Exit if no instances can be found.
+        :param job_id: ID of the job
+        """
+        first_instance = None
+        async for instance in self.aiter_instances(job_id):
+            if first_instance is None:
+                first_instance = instance
             if instance.get('role') == 'MPI_MASTER':
                 return instance
 
-        return None
+        if first_instance is None:
+            logger.error(f'No instances found for JobID {job_id!r}. Is the cluster running?')
+            sys.exit(1)
+
+        return first_instance
+
+    async def aget_head_nodes(self, job_ids):
+        """
+        Get the head nodes of several jobs concurrently.
+        :param job_ids: iterable of job IDs.
+        """
+        try:
+            return await asyncio.gather(*(self.aget_head_node(job_id) for job_id in job_ids))
+        finally:
+            await self.client.aclose()
 
 
 def setup_logging():
@@ -242,26 +462,23 @@ def setup_logging():
     logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(name)s %(levelname)s: %(message)s')
 
 
-def create_temp_ssh_keypair(tempdir, size=2048):
+def create_temp_ssh_keypair():
     """
-    Create an RSA keypair and save the private key and public key to a file in tempdir.
-    :param tempdir: Path object, path where the private key and public key are saved as files.
-    :param size: Size of the SSH key in bits.
+    Create an Ed25519 keypair in memory.
+    Return the Paramiko key object, the private key serialized in OpenSSH PEM format
+    and the public key as a single authorized_keys line.
     """
-    logger.info('Creating temporary SSH keypair.')
-    key = RSAKey.generate(bits=size)
-
-    private_key_path = tempdir.joinpath('tunnel_maker_private_key.pem')
-    public_key_path = tempdir.joinpath('tunnel_maker_public_key.pub')
-
-    key.write_private_key_file(private_key_path)
-    with open(public_key_path, 'w') as f:
-        f.write(f'{key.get_name()} {key.get_base64()}')
+    from paramiko import Ed25519Key
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+    from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, NoEncryption
 
-    logger.info(f"Private key written to: {private_key_path}")
-    logger.info(f"Public key written to: {public_key_path}")
+    logger.info('Creating temporary SSH keypair.')
+    raw_key = ed25519.Ed25519PrivateKey.generate()
+    private_key_bytes = raw_key.private_bytes(Encoding.PEM, PrivateFormat.OpenSSH, NoEncryption())
+    key = Ed25519Key.from_private_key(io.StringIO(private_key_bytes.decode()))
+    public_key_line = f'{key.get_name()} {key.get_base64()}'
 
-    return key, private_key_path, public_key_path
+    return key, private_key_bytes, public_key_line
 
 
 def connect_to_instance(instance, private_key_filename=None, timeout=20):
@@ -271,6 +488,8 @@ def connect_to_instance(instance, private_key_filename=None, timeout=20):
     :param private_key_filename, private key file for authentication
     :param timeout: timeout limit for the SSH connection
     """
+    from fabric import Connection
+
     connect_kwargs = {'key_filename': private_key_filename} if private_key_filename is not None else None
 
     return Connection(
@@ -282,19 +501,27 @@ def connect_to_instance(instance, private_key_filename=None, timeout=20):
     )
 
 
-def test_ssh_connection(connection):
+def test_ssh_connection(connection, deep_check=False):
     """
-    Test SSH connection and exit program if connection is unsuccessful.
+    Open the SSH connection and exit program if the connection is unsuccessful.
+    The connection is left open, so the transport can be reused by subsequent commands.
     :param connection: Connection to test.
+    :param deep_check: If True, also run a test command on the remote host.
     """
     logger.info(f'Testing SSH connection to {connection.host}')
-    result = connection.run('echo "SSH connection successful"', hide=True)
-    if result.ok:
-        logger.info("SSH connection successful")
-    else:
+    connection.open()
+    if not connection.is_connected or not connection.transport.is_active():
         logger.error(f'Could not connect to {connection.host}.')
         sys.exit(1)
 
+    if deep_check:
+        result = connection.run('echo "SSH connection successful"', hide=True)
+        if not result.ok:
+            logger.error(f'Could not run test command on {connection.host}.')
+            sys.exit(1)
+
+    logger.info("SSH connection successful")
+
 
 def setup_tunnel(con_job1, con_job2, cl_args):
     """
@@ -305,27 +532,31 @@ def setup_tunnel(con_job1, con_job2, cl_args):
     :param con_job2: Connection object for job2
     :param cl_args: command line arguments
     """
-    with tempfile.TemporaryDirectory() as td:
-        tempdir = Path(td)
-        logger.info(f'Created temporary directory: {tempdir}')
+    key, private_key_bytes, public_key_line = create_temp_ssh_keypair()
 
-        key, private_key_path, public_key_path = create_temp_ssh_keypair(tempdir)
+    private_key_name = 'tunnel_maker_private_key.pem'
+    logger.info(f'Uploading private key to {con_job1.host}')
+    sftp = con_job1.sftp()
+    sftp.putfo(io.BytesIO(private_key_bytes), private_key_name)
+    sftp.chmod(private_key_name, 0o600)
+    logger.info(f'Uploaded private key to ~/{private_key_name} on {con_job1.host}')
 
-        logger.info(f'Uploading private key to {con_job1.host}')
-        result = con_job1.put(private_key_path)
-        logger.info(f'Uploaded {result.local} to {result.remote} on {con_job1.host}')
-
-    authorized_keys_line = f'{key.get_name()} {key.get_base64()}'
     logger.info(f'Appending public key to ~/.ssh/authorized_keys on {con_job2.host}')
-    con_job2.run(f'echo "{authorized_keys_line}" >> ~/.ssh/authorized_keys', hide=True)
+    con_job2.run(f"printf '%s\\n' '{public_key_line}' >> ~/.ssh/authorized_keys", hide=True)
 
     tunnel_script_name = 'create_ssh_tunnel.sh'
     tunnel_script_content = f"#!/bin/bash\n" \
-                            f"ssh -p {con_job2.port} -i ~/{private_key_path.name} " \
+                            f"ssh -p {con_job2.port} -i ~/{private_key_name} " \
+                            f"-o ControlMaster=auto -o 'ControlPath=~/.ssh/cm-%r@%h:%p' -o ControlPersist=10m " \
                             f"{con_job2.user}@{con_job2.host} -L {cl_args.local_port_forwarding} -N -v"
     logger.info(f'Creating script {tunnel_script_name} on {con_job1.host}')
-    con_job1.run(f'echo "{tunnel_script_content}" >> ~/{tunnel_script_name}', hide=True)
-    con_job1.run(f'chmod 775 ~/{tunnel_script_name}', hide=True)
+    con_job1.run(
+        f"cat > ~/{tunnel_script_name} <<'EOF'\n"
+        f"{tunnel_script_content}\n"
+        f"EOF\n"
+        f"chmod 775 ~/{tunnel_script_name}",
+        hide=True
+    )
 
 
 def main():
@@ -340,19 +571,22 @@ def main():
     api_key, api_base_url = get_api_profile(cl_args)
     api = Api(api_key=api_key, base_url=api_base_url)
 
-    job1_head_node = api.get_head_node(cl_args.job1)
-    job2_head_node = api.get_head_node(cl_args.job2)
-
-    con_job1 = connect_to_instance(job1_head_node, private_key_filename=cl_args.rescale_ssh_private_key)
-    con_job2 = connect_to_instance(job2_head_node, private_key_filename=cl_args.rescale_ssh_private_key)
+    job1_head_node, job2_head_node = api.get_head_nodes([cl_args.job1, cl_args.job2])
 
-    test_ssh_connection(con_job1)
-    test_ssh_connection(con_job2)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        con_job1 = connect_to_instance(job1_head_node, private_key_filename=cl_args.rescale_ssh_private_key)
+        con_job2 = connect_to_instance(job2_head_node, private_key_filename=cl_args.rescale_ssh_private_key)
 
-    setup_tunnel(con_job1, con_job2, cl_args)
+        try:
+            future_test1 = executor.submit(test_ssh_connection, con_job1, deep_check=cl_args.deep_check)
+            future_test2 = executor.submit(test_ssh_connection, con_job2, deep_check=cl_args.deep_check)
+            future_test1.result()
+            future_test2.result()
 
-    con_job1.close()
-    con_job2.close()
+            setup_tunnel(con_job1, con_job2, cl_args)
+        finally:
+            con_job1.close()
+            con_job2.close()
 
     logger.info('DONE')
 